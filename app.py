@@ -1,21 +1,220 @@
-from flask import Flask, render_template, request, send_file
+from flask import Flask, jsonify, render_template, request, send_from_directory, url_for
 from werkzeug.utils import secure_filename
+import concurrent.futures
+import hashlib
+import multiprocessing
 import os
+import shutil
+import uuid
+import zstandard
 from dxf_to_gcode import dxf_to_gcode, simulate_gcode, DEFAULT_FEED_RATE_XY, DEFAULT_FEED_RATE_Z, DEFAULT_SAFE_Z, DEFAULT_CUT_Z
 
 # Configuration
-global UPLOAD_FOLDER, OUTPUT_FOLDER, ALLOWED_EXTENSIONS
-UPLOAD_FOLDER = 'uploads'
-OUTPUT_FOLDER = 'outputs'
-ALLOWED_EXTENSIONS = {'dxf'}
+global UPLOAD_FOLDER, OUTPUT_FOLDER, ALLOWED_SUFFIXES
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))  # resolved once, independent of the CWD
+UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
+OUTPUT_FOLDER = os.path.join(BASE_DIR, 'outputs')
+ALLOWED_SUFFIXES = tuple('.' + ext for ext in ('dxf',))
+PARAM_KEYS = ('offset_x', 'offset_y', 'start_x', 'start_y', 'end_x', 'end_y')  # simulate_gcode order
+STREAM_CHUNK_SIZE = 1 << 20  # 1 MiB per read when streaming uploads to disk
+ZSTD_LEVEL = 3  # G-code text typically shrinks 5-10x at this level
+# Plot render processes per app process (default: one per CPU). Every gunicorn worker
+# gets its own pool, so with -w N set this to about nproc / N.
+PLOT_WORKERS = int(os.environ.get('PLOT_WORKERS') or 0) or None
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 
+# Plot rendering runs off the request path; jobs are keyed by cache_key(). The pool starts on
+# the first submit(), from a request thread: forking a multi-threaded process can deadlock
+# on locks other threads hold, so workers come from a forkserver (spawn where unavailable).
+PLOT_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+plot_executor = concurrent.futures.ProcessPoolExecutor(max_workers=PLOT_WORKERS,
+                                                       mp_context=multiprocessing.get_context(PLOT_START_METHOD))
+plot_jobs = {}  # job_id -> Future, while the job is running
+
 # Utility to check file extension
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return filename.lower().endswith(ALLOWED_SUFFIXES)
+
+def new_digest():
+    # Cache keys need speed rather than cryptographic strength; 128-bit BLAKE2b is
+    # markedly cheaper per byte than SHA-256 on CPUs without SHA extensions
+    return hashlib.blake2b(digest_size=16)
+
+def file_digest(path):
+    """Hex new_digest() of a file's contents, read in STREAM_CHUNK_SIZE chunks."""
+    h = new_digest()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def save_upload(stream, name=None):
+    """Store the DXF read from stream under its content digest; return (digest, path).
+
+    The bytes are hashed as they are written to a private temp file, and the file at the
+    returned path is never rewritten in place, so it always holds the bytes that were hashed.
+    With a name, uploads/<name> (what the refresh form converts again) is then pointed at it.
+    """
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], 'by-digest')  # no upload name can reach it
+    os.makedirs(folder, exist_ok=True)
+    tmp = temp_path(os.path.join(folder, 'upload'))
+    h = new_digest()
+    with open(tmp, 'wb') as f:
+        for chunk in iter(lambda: stream.read(STREAM_CHUNK_SIZE), b''):
+            h.update(chunk)
+            f.write(chunk)
+    digest = h.hexdigest()
+    dxf_path = os.path.join(folder, digest + '.dxf')
+    os.replace(tmp, dxf_path)
+    if name is not None:
+        name_path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+        tmp = temp_path(name_path)
+        try:
+            os.link(dxf_path, tmp)
+        except OSError:
+            shutil.copyfile(dxf_path, tmp)
+        os.replace(tmp, name_path)
+        if os.path.exists(tmp):
+            os.remove(tmp)  # rename() is a no-op when both names already link the same file
+    return digest, dxf_path
+
+def cache_key(digest, base, values):
+    """Cache key: the DXF's content digest plus everything else that shapes the output."""
+    h = new_digest()
+    h.update(digest.encode())
+    # base is part of the key because the plot page embeds it in its refresh/download links
+    h.update(repr((base,) + values).encode())
+    return h.hexdigest()
+
+def cached_plot(key, base):
+    """Serve a complete cache entry (restoring <base>.gcode for /download), or None on a miss."""
+    cache_gcode = os.path.join(app.config['OUTPUT_FOLDER'], f"{key}.gcode")
+    plot_filename = f"{key}.html"
+    if (request.args.get('nocache') == '1' or not os.path.exists(cache_gcode)
+            or not os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], plot_filename))):
+        return None
+    restore_gcode(key, base)
+    return send_from_directory(app.config['OUTPUT_FOLDER'], plot_filename, conditional=True, etag=True)
+
+def remove_if_exists(path):
+    """os.remove() that tolerates a concurrent request having removed path first."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def temp_path(path):
+    """A temp file name next to path that no concurrent request shares."""
+    return f"{path}.{uuid.uuid4().hex}.tmp"
+
+def publish_gcode(gcode_path, key):
+    """Move gcode_path (a temp file) into the cache as <key>.gcode plus a zstd-compressed <key>.gcode.zst."""
+    cache_gcode = os.path.join(app.config['OUTPUT_FOLDER'], f"{key}.gcode")
+    zst_tmp = temp_path(cache_gcode + '.zst')
+    with open(gcode_path, 'rb') as src, open(zst_tmp, 'wb') as dst:
+        zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(src, dst)
+    os.replace(zst_tmp, cache_gcode + '.zst')
+    # Moved in last: the presence of <key>.gcode marks a complete entry
+    os.replace(gcode_path, cache_gcode)
+
+def restore_gcode(key, base):
+    """Copy cached <key> G-code files to the <base> names that /download serves (key=None removes them)."""
+    for suffix in ('.gcode', '.gcode.zst'):
+        src = key and os.path.join(app.config['OUTPUT_FOLDER'], key + suffix)
+        dst = os.path.join(app.config['OUTPUT_FOLDER'], base + suffix)
+        if src and os.path.exists(src):
+            # Via a temp file, so concurrent requests for the same name never interleave writes
+            tmp = temp_path(dst)
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, dst)
+        else:
+            remove_if_exists(dst)  # never serve a compressed copy of a different program
+
+def error_marker(plot_path):
+    """<key>.err next to the <key>.html plot: written when that plot's render fails."""
+    return os.path.splitext(plot_path)[0] + '.err'
+
+def render_plot(gcode_path, name, params, plot_path, moves=None):
+    """Background job: simulate gcode_path (or its already-parsed moves) and publish the page at plot_path.
+
+    A failure is recorded on disk as well as in the job's Future, since the /plot_status poll
+    may be answered by a worker process that never saw the Future.
+    """
+    tmp_path = f"{plot_path}.{os.getpid()}.tmp"
+    try:
+        simulate_gcode(gcode_path, *params, html_filepath=tmp_path, name=name, moves=moves)
+        # Publish atomically so /plot_status never serves a half-written page
+        os.replace(tmp_path, plot_path)
+    except Exception as e:
+        with open(error_marker(plot_path), 'w') as f:
+            f.write(f"{type(e).__name__}: {e}\n")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def finish_job(key, job, plot_path):
+    """Done-callback of a plot job: forget it, leaving its outcome on disk for /plot_status."""
+    if plot_jobs.get(key) is job:
+        plot_jobs.pop(key, None)
+    # render_plot() marks its own failures; this covers a worker that died without doing so
+    if not job.cancelled() and job.exception() is not None and not os.path.exists(error_marker(plot_path)):
+        with open(error_marker(plot_path), 'w') as f:
+            f.write(f"{type(job.exception()).__name__}: {job.exception()}\n")
+
+def read_values(params):
+    # Offsets, custom start point and custom end point (blank fields count as 0)
+    return tuple(float(params.get(k) or 0) for k in PARAM_KEYS)
+
+def convert_and_render(dxf_path, digest, base, params):
+    """Convert the DXF at dxf_path and return its plot, or a pending response while it renders.
+
+    dxf_path and digest come from save_upload(). Results are cached in OUTPUT_FOLDER by
+    cache_key(); pass ?nocache=1 to force regeneration.
+    """
+    values = read_values(params)
+    key = cache_key(digest, base, values)
+    hit = cached_plot(key, base)
+    if hit is not None:
+        return hit
+    # Content-addressed cache entries
+    cache_gcode = os.path.join(app.config['OUTPUT_FOLDER'], f"{key}.gcode")
+    cache_plot = os.path.join(app.config['OUTPUT_FOLDER'], f"{key}.html")
+    moves = None
+    if request.args.get('nocache') == '1' or not os.path.exists(cache_gcode):
+        # Convert into a per-request temp file: <base>.gcode is shared by every request
+        # for the same name and is only ever written from the cache
+        gcode_path = temp_path(cache_gcode)
+        try:
+            moves = dxf_to_gcode(dxf_path, gcode_path, DEFAULT_FEED_RATE_XY, DEFAULT_FEED_RATE_Z, DEFAULT_SAFE_Z, DEFAULT_CUT_Z, *values,
+                                 return_moves=True, dxf_digest=digest)
+            if moves is None:  # unreadable DXF (dxf_to_gcode has logged why); cache nothing
+                restore_gcode(None, base)  # and stop serving the program of the name's previous upload
+                return 'Could not convert DXF file', 400
+            publish_gcode(gcode_path, key)
+        finally:
+            if os.path.exists(gcode_path):
+                os.remove(gcode_path)  # left behind only when nothing was published
+    restore_gcode(key, base)
+    for stale in (cache_plot, error_marker(cache_plot)):
+        remove_if_exists(stale)  # ?nocache=1 or a retry: /plot_status must wait for the fresh render
+    # Render from the key-addressed copy: <base>.gcode may be replaced by the next request
+    if key not in plot_jobs:
+        job = plot_executor.submit(render_plot, cache_gcode, base, values, cache_plot, moves)
+        plot_jobs[key] = job
+        job.add_done_callback(lambda job: finish_job(key, job, cache_plot))
+    payload = {
+        'job_id': key,
+        'gcode_url': url_for('download_gcode', filename=base),
+        'plot_url': url_for('plot_status', job_id=key),
+    }
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(payload), 202
+    return render_template('pending.html', **payload), 202
 
 @app.route('/')
 def index():
@@ -29,32 +228,59 @@ def convert():
         if not allowed_file(file.filename):
             return 'File type not allowed', 400
         filename = secure_filename(file.filename)
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        dxf_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(dxf_path)
+        digest, dxf_path = save_upload(file.stream, filename)
         base = os.path.splitext(filename)[0]
     elif 'filename' in request.form:
         base = request.form['filename']
-        dxf_path = os.path.join(app.config['UPLOAD_FOLDER'], base + '.dxf')
+        name_path = os.path.join(app.config['UPLOAD_FOLDER'], base + '.dxf')
+        if not os.path.exists(name_path):
+            return 'Not found', 404
+        # Snapshot the upload: a concurrent upload may replace <base>.dxf at any time
+        with open(name_path, 'rb') as f:
+            digest, dxf_path = save_upload(f)
     else:
         return 'No file provided', 400
-    # Prepare G-code output path
-    gcode_filename = f"{base}.gcode"
-    os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
-    gcode_path = os.path.join(app.config['OUTPUT_FOLDER'], gcode_filename)
-    # Read offsets
-    offset_x = float(request.form.get('offset_x', 0))
-    offset_y = float(request.form.get('offset_y', 0))
-    # Read custom start point
-    start_x = float(request.form.get('start_x', 0))
-    start_y = float(request.form.get('start_y', 0))
-    # Read custom end point
-    end_x = float(request.form.get('end_x', 0))
-    end_y = float(request.form.get('end_y', 0))
-    # Generate and simulate
-    dxf_to_gcode(dxf_path, gcode_path, DEFAULT_FEED_RATE_XY, DEFAULT_FEED_RATE_Z, DEFAULT_SAFE_Z, DEFAULT_CUT_Z, offset_x, offset_y, start_x, start_y, end_x, end_y)
-    simulate_gcode(gcode_path, offset_x, offset_y, start_x, start_y, end_x, end_y)
-    return send_file(os.path.join(os.getcwd(), 'simulation_plot.html'))
+    return convert_and_render(dxf_path, digest, base, request.form)
+
+@app.route('/convert_stream', methods=['POST'])
+def convert_stream():
+    # Raw DXF body (application/octet-stream), name in X-Filename, options in the query string.
+    # Bypasses the multipart parser and its temporary spool file.
+    if request.mimetype != 'application/octet-stream':
+        return 'Expected application/octet-stream', 415
+    filename = secure_filename(os.path.basename(request.headers.get('X-Filename', '')))
+    if not filename:
+        return 'No file provided', 400
+    if not allowed_file(filename):
+        return 'File type not allowed', 400
+    name_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    base = os.path.splitext(filename)[0]
+    # A client that sends the body's file_digest() in X-Content-Digest gets a cache hit
+    # answered without the body being read. The upload on disk must be that same drawing:
+    # the refresh form and /download act on it.
+    client_digest = (request.headers.get('X-Content-Digest') or '').lower()
+    if client_digest and os.path.exists(name_path) and file_digest(name_path) == client_digest:
+        hit = cached_plot(cache_key(client_digest, base, read_values(request.args)), base)
+        if hit is not None:
+            return hit
+    # Hashed while streaming, so the upload is never read back from disk
+    digest, dxf_path = save_upload(request.stream, filename)
+    return convert_and_render(dxf_path, digest, base, request.args)
+
+@app.route('/plot_status/<job_id>', methods=['GET'])
+def plot_status(job_id):
+    # 200 + page once rendered, 202 while rendering, 500 if the job failed, 404 if unknown.
+    # Answered from the file system so any worker process can serve the poll.
+    if not job_id.isalnum():
+        return 'Not found', 404
+    plot_filename = f"{job_id}.html"
+    if os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], plot_filename)):
+        return send_from_directory(app.config['OUTPUT_FOLDER'], plot_filename, conditional=True, etag=True)
+    if os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], f"{job_id}.err")):
+        return 'Plot rendering failed', 500
+    if job_id not in plot_jobs and not os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], f"{job_id}.gcode")):
+        return 'Not found', 404
+    return '', 202
 
 @app.route('/download', methods=['GET'])
 def download_gcode():
@@ -64,7 +290,25 @@ def download_gcode():
     path = os.path.join(app.config['OUTPUT_FOLDER'], fname + '.gcode')
     if not os.path.exists(path):
         return 'Not found', 404
-    return send_file(path, as_attachment=True)
+    # The same URL serves new content after every re-conversion, so let clients cache
+    # but always revalidate (max_age=0): unchanged files come back as 304 Not Modified.
+    # Clients that accept zstd get the pre-compressed copy.
+    zst_path = path + '.zst'
+    if request.accept_encodings.quality('zstd') > 0 and os.path.exists(zst_path):
+        response = send_from_directory(app.config['OUTPUT_FOLDER'], fname + '.gcode.zst', as_attachment=True,
+                                       download_name=fname + '.gcode', conditional=True, etag=True,
+                                       last_modified=os.path.getmtime(zst_path), max_age=0)
+        response.headers['Content-Encoding'] = 'zstd'
+    else:
+        response = send_from_directory(app.config['OUTPUT_FOLDER'], fname + '.gcode', as_attachment=True,
+                                       conditional=True, etag=True, last_modified=os.path.getmtime(path), max_age=0)
+    response.vary.add('Accept-Encoding')
+    return response
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Requests are served on threads; the CPU-heavy plot rendering already runs on
+    # plot_executor's worker processes. (A forking server would lose each request's
+    # background job when its child process exits.)
+    # For production use gunicorn instead: PLOT_WORKERS=1 gunicorn -w $(nproc) -k gthread --threads 2 app:app
+    debug = os.environ.get('FLASK_DEBUG') == '1'
+    app.run(debug=debug, host='0.0.0.0', threaded=True)
@@ -1,6 +1,26 @@
 import ezdxf
+import numpy as np
 
-def create_sample_dxf(filename="test_pattern.dxf"):
+def spiral_points(center, turns, n, pitch=1.0, out=None):
+    """Vertices of an Archimedean spiral as an (n, 2) float64 array.
+
+    The columns are filled in place (into `out` when given), so no temporary
+    per-coordinate arrays are allocated.
+    """
+    if out is None:
+        out = np.empty((n, 2), dtype=np.float64)
+    t = np.linspace(0.0, turns * 2 * np.pi, n)
+    r = t * (pitch / (2 * np.pi))  # radius grows by `pitch` per turn
+    xs, ys = out[:, 0], out[:, 1]
+    np.cos(t, out=xs)
+    np.sin(t, out=ys)
+    xs *= r
+    ys *= r
+    xs += center[0]
+    ys += center[1]
+    return out
+
+def create_sample_dxf(filename="test_pattern.dxf", spiral_vertices=0):
     doc = ezdxf.new(dxfversion='R2010')  # Create a new DXF document
     msp = doc.modelspace()  # Get the modelspace
 
@@ -31,8 +51,12 @@ def create_sample_dxf(filename="test_pattern.dxf"):
 
     # Add an LWPOLYLINE (a lightweight polyline)
     # A rectangle from (10,10) to (40,30)
-    points = [(110, 10), (140, 10), (140, 30), (110, 30), (110, 10)]
-    msp.add_lwpolyline(points)
+    points = np.asarray([(110, 10), (140, 10), (140, 30), (110, 30), (110, 10)], dtype=np.float64)
+    msp.add_lwpolyline(points.tolist())
+
+    # Optional dense LWPOLYLINE: a 5-turn spiral centred at (75, 75)
+    if spiral_vertices:
+        msp.add_lwpolyline(spiral_points((75, 75), 5, spiral_vertices, pitch=4.0))
 
     try:
         doc.saveas(filename)
@@ -1,20 +1,66 @@
 import ezdxf
 import math
 import argparse
-import sys # Ensure sys is imported
+import collections
+import functools
+import html
+import itertools
+import logging
 import os
 import re
+import numpy as np
 import plotly.graph_objects as go
 import plotly.colors as pcolors
 
 # 使用Plotly替代Matplotlib
 
+log = logging.getLogger(__name__)
+
 # Default G-code parameters (can be overridden by command-line arguments)
 DEFAULT_FEED_RATE_XY = 300.0  # mm/min or units/min
 DEFAULT_FEED_RATE_Z = 100.0   # mm/min or units/min
 DEFAULT_SAFE_Z = 5.0         # Z height for rapid moves
 DEFAULT_CUT_Z = -0.3         # Z depth for cutting (relative to Z=0 on material surface)
 
+# Coordinate words read back by the simulator, in parse_gcode_moves() column order
+GCODE_AXES = 'XYZIJ'
+# Matched against the program's code lines as one bytes buffer; newlines delimit the lines
+GCODE_WORD_RE = re.compile(rb'\n|[XYZIJ][-+]?\d*\.?\d+')
+ARC_TOLERANCE = 0.05  # max chord deviation (units) when drawing arcs as polylines
+
+
+# Entity emitters produce move records (code, X, Y, Z, I, J, F); absent words are NaN
+NAN = float('nan')
+
+def rapid_xy(x, y):
+    return ('G00', x, y, NAN, NAN, NAN, NAN)
+
+def rapid_z(z):
+    return ('G00', NAN, NAN, z, NAN, NAN, NAN)
+
+def feed_xy(x, y, feed_rate):
+    return ('G01', x, y, NAN, NAN, NAN, feed_rate)
+
+def feed_z(z, feed_rate):
+    return ('G01', NAN, NAN, z, NAN, NAN, feed_rate)
+
+def arc_move(command, x, y, i, j, feed_rate):
+    return (command, x, y, NAN, i, j, feed_rate)
+
+def format_move(code, x, y, z, i, j, f):
+    """G-code line for a move record, skipping NaN words.
+
+    Branches on the record shapes built above (Z or XY moves, arcs always with I, J and F)
+    so each line is a single %-format.
+    """
+    if z == z:
+        return '%s Z%.3f F%.1f' % (code, z, f) if f == f else '%s Z%.3f' % (code, z)
+    if i == i:
+        return '%s X%.3f Y%.3f I%.3f J%.3f F%.1f' % (code, x, y, i, j, f)
+    if f == f:
+        return '%s X%.3f Y%.3f F%.1f' % (code, x, y, f)
+    return '%s X%.3f Y%.3f' % (code, x, y)
+
 
 def generate_gcode_header(safe_z):
     return [
@@ -22,51 +68,58 @@ def generate_gcode_header(safe_z):
         "G90",          # Absolute programming
         "G17",          # Select XY plane
         "M3 S1000",     # Spindle on, 1000 RPM (example)
-        f"G00 Z{safe_z:.3f}"  # Rapid move to safe Z
+        format_move(*rapid_z(safe_z))  # Rapid move to safe Z
     ]
 
 def generate_gcode_footer(safe_z):
     return [
-        f"G00 Z{safe_z:.3f}", # Retract to safe Z
+        format_move(*rapid_z(safe_z)), # Retract to safe Z
         "M5",           # Spindle off
         "G00 X0 Y0",    # Go to machine home (optional)
         "M2"            # Program end
     ]
 
+def _near(cp, x, y, eps2=1e-12):
+    """True if the tool position cp is already at (x, y), i.e. within 1e-6 units."""
+    return cp is not None and (cp[0] - x) * (cp[0] - x) + (cp[1] - y) * (cp[1] - y) < eps2
+
 def line_to_gcode(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z):
-    gcode_lines = []
-    start_point = entity.dxf.start
-    end_point = entity.dxf.end
+    moves = []
+    dxf = entity.dxf  # each dxf.<attr> read goes through ezdxf's attribute lookup
+    start_point = dxf.start
+    end_point = dxf.end
+    log.debug("  Found LINE from (%.2f, %.2f) to (%.2f, %.2f)", start_point.x, start_point.y, end_point.x, end_point.y)
 
     # 1. Rapid move to above the start point of the line
-    if current_pos is None or not (math.isclose(current_pos[0], start_point.x) and math.isclose(current_pos[1], start_point.y)):
-        gcode_lines.append(f"G00 X{start_point.x:.3f} Y{start_point.y:.3f}")
+    if not _near(current_pos, start_point.x, start_point.y):
+        moves.append(rapid_xy(start_point.x, start_point.y))
     
     # 2. Plunge to cutting depth
-    gcode_lines.append(f"G01 Z{cut_z:.3f} F{feed_rate_z:.1f}")
+    moves.append(feed_z(cut_z, feed_rate_z))
     
     # 3. Linear move to the end point of the line
-    gcode_lines.append(f"G01 X{end_point.x:.3f} Y{end_point.y:.3f} F{feed_rate_xy:.1f}")
+    moves.append(feed_xy(end_point.x, end_point.y, feed_rate_xy))
     
     # 4. Retract to safe Z (optional, can be done after all paths of a layer)
-    gcode_lines.append(f"G00 Z{safe_z:.3f}")
+    moves.append(rapid_z(safe_z))
     
     current_pos = (end_point.x, end_point.y, safe_z)
-    return gcode_lines, current_pos
+    return moves, current_pos
 
 
 def arc_to_gcode(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z):
-    gcode_lines = []
-    center = entity.dxf.center
-    radius = entity.dxf.radius
-    start_angle = entity.dxf.start_angle
-    end_angle = entity.dxf.end_angle
+    moves = []
+    dxf = entity.dxf
+    center = dxf.center
+    radius = dxf.radius
+    raw_start_angle = dxf.start_angle
+    raw_end_angle = dxf.end_angle
+    log.debug("  Found ARC center=(%.2f, %.2f), R=%.2f, StartAngle=%.2f, EndAngle=%.2f",
+              center.x, center.y, radius, raw_start_angle, raw_end_angle)
     
     # 规范化角度至0-360度范围
-    while start_angle < 0: start_angle += 360
-    while start_angle >= 360: start_angle -= 360
-    while end_angle < 0: end_angle += 360
-    while end_angle >= 360: end_angle -= 360
+    start_angle = raw_start_angle % 360.0
+    end_angle = raw_end_angle % 360.0
     
     # 计算起始点和终点坐标
     start_angle_rad = math.radians(start_angle)
@@ -81,23 +134,23 @@ def arc_to_gcode(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z):
     j_offset = center.y - start_y
     
     # 打印原始角度信息以及起点和终点
-    print(f"  Arc original: start_angle={entity.dxf.start_angle:.2f}, end_angle={entity.dxf.end_angle:.2f}")
-    print(f"  Arc normalized: start_angle={start_angle:.2f}, end_angle={end_angle:.2f}")
-    print(f"  Arc endpoints: start=({start_x:.2f},{start_y:.2f}), end=({end_x:.2f},{end_y:.2f})")
+    log.debug("  Arc original: start_angle=%.2f, end_angle=%.2f", raw_start_angle, raw_end_angle)
+    log.debug("  Arc normalized: start_angle=%.2f, end_angle=%.2f", start_angle, end_angle)
+    log.debug("  Arc endpoints: start=(%.2f,%.2f), end=(%.2f,%.2f)", start_x, start_y, end_x, end_y)
     
     # DXF ARC 定义：从 start_angle 到 end_angle 逆时针。
     ccw_angle = (end_angle - start_angle) % 360
-    print(f"  CCW angle: {ccw_angle:.2f}°")
+    log.debug("  CCW angle: %.2f°", ccw_angle)
     # 如果之前 G03 (CCW 指令) 导致方向错误，则尝试 G02 (CW 指令)
     # 来正确表示 DXF 中定义的 CCW 圆弧。
     arc_command = "G02" # 注意：这里改为 G02
      
     # 判断是否分段（大于180°需分两段）
     if ccw_angle <= 180:
-        print(f"  Minor arc ({ccw_angle:.2f}°), single segment, command {arc_command}")
+        log.debug("  Minor arc (%.2f°), single segment, command %s", ccw_angle, arc_command)
         segments = [(end_x, end_y, i_offset, j_offset)]
     else:
-        print(f"  Major arc ({ccw_angle:.2f}°), splitting at 180°, command {arc_command}")
+        log.debug("  Major arc (%.2f°), splitting at 180°, command %s", ccw_angle, arc_command)
         # 分割点依然是沿 CCW 路径前进 180 度
         mid_angle = (start_angle + 180) % 360
         mid_rad = math.radians(mid_angle)
@@ -106,32 +159,32 @@ def arc_to_gcode(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z):
         i1, j1 = i_offset, j_offset
         i2, j2 = center.x - mid_x, center.y - mid_y
         segments = [(mid_x, mid_y, i1, j1), (end_x, end_y, i2, j2)]
-    # 此行已在分段逻辑中通过新的print语句覆盖，或可删除
-    # print(f"  G-code command: {arc_command}, segments: {len(segments)}") 
  
     # 1. 快速定位到弧的起始点上方
-    if current_pos is None or not (math.isclose(current_pos[0], start_x) and math.isclose(current_pos[1], start_y)):
-        gcode_lines.append(f"G00 X{start_x:.3f} Y{start_y:.3f}")
+    if not _near(current_pos, start_x, start_y):
+        moves.append(rapid_xy(start_x, start_y))
     
     # 2. 下刀到切削深度
-    gcode_lines.append(f"G01 Z{cut_z:.3f} F{feed_rate_z:.1f}")
+    moves.append(feed_z(cut_z, feed_rate_z))
     
     # 3. 弧形移动，可能分段
     for x, y, i_off, j_off in segments:
-        gcode_lines.append(f"{arc_command} X{x:.3f} Y{y:.3f} I{i_off:.3f} J{j_off:.3f} F{feed_rate_xy:.1f}")
+        moves.append(arc_move(arc_command, x, y, i_off, j_off, feed_rate_xy))
     
     # 4. 提升到安全高度
-    gcode_lines.append(f"G00 Z{safe_z:.3f}")
+    moves.append(rapid_z(safe_z))
     
     # 更新当前位置
     current_pos = (end_x, end_y, safe_z)
-    return gcode_lines, current_pos
+    return moves, current_pos
 
 
 def circle_to_gcode(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z):
-    gcode_lines = []
-    center = entity.dxf.center
-    radius = entity.dxf.radius
+    moves = []
+    dxf = entity.dxf
+    center = dxf.center
+    radius = dxf.radius
+    log.debug("  Found CIRCLE center=(%.2f, %.2f), R=%.2f", center.x, center.y, radius)
 
     # Define points for two semi-circles
     # Start point of 1st semi-circle (and end point of 2nd)
@@ -158,87 +211,129 @@ def circle_to_gcode(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_
     j2_offset = center.y - p1_end_y # This will be 0
     
     # 1. Rapid move to above the start point of the first semi-circle
-    if current_pos is None or not (math.isclose(current_pos[0], p1_start_x) and math.isclose(current_pos[1], p1_start_y)):
-        gcode_lines.append(f"G00 X{p1_start_x:.3f} Y{p1_start_y:.3f}")
+    if not _near(current_pos, p1_start_x, p1_start_y):
+        moves.append(rapid_xy(p1_start_x, p1_start_y))
     
     # 2. Plunge to cutting depth
-    gcode_lines.append(f"G01 Z{cut_z:.3f} F{feed_rate_z:.1f}")
+    moves.append(feed_z(cut_z, feed_rate_z))
     
     # 3. First semi-circle (e.g., bottom half, CW)
     # G02 X<end_x> Y<end_y> I<center_x_offset_from_start> J<center_y_offset_from_start>
-    gcode_lines.append(f"G02 X{p1_end_x:.3f} Y{p1_end_y:.3f} I{i1_offset:.3f} J{j1_offset:.3f} F{feed_rate_xy:.1f}")
+    moves.append(arc_move('G02', p1_end_x, p1_end_y, i1_offset, j1_offset, feed_rate_xy))
     
     # 4. Second semi-circle (e.g., top half, CW)
     # Current position is now p1_end_x, p1_end_y
-    gcode_lines.append(f"G02 X{p1_start_x:.3f} Y{p1_start_y:.3f} I{i2_offset:.3f} J{j2_offset:.3f} F{feed_rate_xy:.1f}")
+    moves.append(arc_move('G02', p1_start_x, p1_start_y, i2_offset, j2_offset, feed_rate_xy))
 
     # 5. Retract to safe Z
-    gcode_lines.append(f"G00 Z{safe_z:.3f}")
+    moves.append(rapid_z(safe_z))
     
     current_pos = (p1_start_x, p1_start_y, safe_z) # End position after full circle is back at its start
-    return gcode_lines, current_pos
+    return moves, current_pos
+
+
+def bulge_to_gcode(px1, py1, px2, py2, bulge, feed_rate_xy):
+    """Arc move(s) for an LWPOLYLINE segment from (px1, py1) to (px2, py2) with the given bulge."""
+    dx, dy = px2 - px1, py2 - py1
+    if dx == 0 and dy == 0:
+        # Coincident vertices: an arc would have zero radius, which controllers reject
+        return [feed_xy(px2, py2, feed_rate_xy)]
+    # Center lies on the chord's perpendicular bisector, left of the chord for a CCW (positive) bulge
+    k = (1 - bulge * bulge) / (4 * bulge)
+    center_x = (px1 + px2) / 2 - k * dy
+    center_y = (py1 + py2) / 2 + k * dx
+    # Same convention as arc_to_gcode: CCW DXF arcs are emitted as G02
+    arc_command = "G02" if bulge > 0 else "G03"
+    if abs(bulge) <= 1:
+        segments = [(px2, py2, center_x - px1, center_y - py1)]
+    else:
+        # Major arc (over 180°): split at the arc's midpoint, like arc_to_gcode
+        mid_x = (px1 + px2) / 2 + bulge * dy / 2
+        mid_y = (py1 + py2) / 2 - bulge * dx / 2
+        segments = [(mid_x, mid_y, center_x - px1, center_y - py1),
+                    (px2, py2, center_x - mid_x, center_y - mid_y)]
+    return [arc_move(arc_command, x, y, i_off, j_off, feed_rate_xy) for x, y, i_off, j_off in segments]
 
 
 def lwpolyline_to_gcode(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z):
-    gcode_lines = []
-    # ezdxf lwpolyline points are (x, y, start_width, end_width, bulge)
-    # We are only interested in x, y for now (indices 0 and 1)
-    points = list(entity.get_points(format='xyseb')) # format provides (x,y,start_width,end_width,bulge)
-
-    if not points:
+    moves = []
+    log.debug("  Found LWPOLYLINE with %d points.", len(entity))
+    # Only x, y and bulge are needed; widths are not requested. Vertices are consumed one at a
+    # time (ezdxf versions that build a list return one; it is not copied again here)
+    points = iter(entity.get_points(format='xyb'))
+    first = next(points, None)
+    if first is None:
         return [], current_pos
 
-    start_x, start_y, _, _, start_bulge = points[0]
+    start_x, start_y, bulge = first
 
     # 1. Rapid move to above the start point of the polyline
-    if current_pos is None or not (math.isclose(current_pos[0], start_x) and math.isclose(current_pos[1], start_y)):
-        gcode_lines.append(f"G00 X{start_x:.3f} Y{start_y:.3f}")
+    if not _near(current_pos, start_x, start_y):
+        moves.append(rapid_xy(start_x, start_y))
     
     # 2. Plunge to cutting depth
-    gcode_lines.append(f"G01 Z{cut_z:.3f} F{feed_rate_z:.1f}")
+    moves.append(feed_z(cut_z, feed_rate_z))
     current_x, current_y = start_x, start_y
-    current_pos = (current_x, current_y, cut_z) # update current_pos to be at cut depth
 
-    # Iterate through segments (from point i to point i+1)
-    for i in range(len(points) - 1):
-        px1, py1, _, _, bulge = points[i]
-        px2, py2, _, _, _ = points[i+1]
+    # Iterate through segments; a vertex's bulge applies to the segment starting at it
+    for px2, py2, next_bulge in points:
+        px1, py1 = current_x, current_y
 
         if bulge != 0:
-            # TODO: Implement bulge to arc conversion
-            # For now, we print a warning and skip arc segments
-            print(f"    LWPOLYLINE segment from ({px1:.2f}, {py1:.2f}) to ({px2:.2f}, {py2:.2f}) has a bulge ({bulge:.2f}) - ARC SEGMENT SKIPPED.")
-            # As a fallback, we could rapid move to the start of the next segment if we skip an arc
-            # For now, we'll just continue, which means the tool stays at the end of the last processed segment.
-            # To ensure the next straight segment starts correctly, we might need a G00 to px2, py2 if we are not already there
-            # However, if the next segment is also a bulge, this logic would be complex.
-            # Simplest for now: if we hit a bulge, we might have an issue with the next G01 if tool path is broken.
-            # Let's assume for now that if a bulge is skipped, the next segment is a line that starts from the bulge's end point
-            # This requires getting the end point of the arc represented by the bulge.
-            # This is complex, so for V1, we just warn and the G-code might be incomplete for polylines with arcs.
-            # A better V1 for bulges is to treat them as straight lines between their vertex points.
-            gcode_lines.append(f"; WARNING: LWPOLYLINE bulge segment from ({px1:.2f}, {py1:.2f}) to ({px2:.2f}, {py2:.2f}) treated as straight line.")
-            gcode_lines.append(f"G01 X{px2:.3f} Y{py2:.3f} F{feed_rate_xy:.1f}") # Treat bulge as straight line
+            # Bulge arc: the segment's included angle is 4*atan(bulge), positive = CCW
+            log.debug("    LWPOLYLINE bulge segment from (%.2f, %.2f) to (%.2f, %.2f), bulge %.2f",
+                      px1, py1, px2, py2, bulge)
+            moves.extend(bulge_to_gcode(px1, py1, px2, py2, bulge, feed_rate_xy))
         else:
             # Straight line segment
-            gcode_lines.append(f"G01 X{px2:.3f} Y{py2:.3f} F{feed_rate_xy:.1f}")
+            moves.append(feed_xy(px2, py2, feed_rate_xy))
         
-        current_x, current_y = px2, py2
-        current_pos = (current_x, current_y, cut_z)
+        current_x, current_y, bulge = px2, py2, next_bulge
 
     # If the polyline is closed and the last segment was a line (not a skipped bulge leading to it),
     # and it connects back to the very first point, no extra move is needed.
     # ezdxf handles 'closed' property separately. get_points() gives all points including closing one if closed.
 
     # Retract to safe Z after the entire polyline is done
-    gcode_lines.append(f"G00 Z{safe_z:.3f}")
+    moves.append(rapid_z(safe_z))
     current_pos = (current_x, current_y, safe_z)
 
-    return gcode_lines, current_pos
+    return moves, current_pos
+
+
+# DXF entity type -> emitter, all called as handler(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z)
+ENTITY_HANDLERS = {
+    'LINE': line_to_gcode,
+    'ARC': arc_to_gcode,
+    'CIRCLE': circle_to_gcode,
+    'LWPOLYLINE': lwpolyline_to_gcode,
+}
+
+
+def _arc_segs(radius, sweep_rad, tol=ARC_TOLERANCE):
+    """Number of chords needed to draw an arc of the given sweep within tol of the true curve."""
+    step = 2 * math.acos(max(-1.0, 1 - tol / max(radius, 1e-9)))
+    return max(2, int(math.ceil(abs(sweep_rad) / step)))
+
+
+def sample_arc(center_x, center_y, radius, start_angle, end_angle, num_points):
+    """Return (xs, ys) arrays of num_points evenly spaced points from start_angle to end_angle (radians).
 
+    Each point is the previous one rotated by the constant step angle, so only one
+    sin/cos pair is evaluated per arc rather than one per point.
+    """
+    step = (end_angle - start_angle) / max(num_points - 1, 1)
+    rotor = np.full(num_points, complex(math.cos(step), math.sin(step)))
+    rotor[0] = complex(radius * math.cos(start_angle), radius * math.sin(start_angle))
+    points = np.cumprod(rotor)
+    return center_x + points.real, center_y + points.imag
 
-def get_arc_points(current_x, current_y, target_x, target_y, i_offset, j_offset, is_clockwise, num_segments=20):
-    """Helper function to generate points along an arc for plotting."""
+
+def get_arc_points(current_x, current_y, target_x, target_y, i_offset, j_offset, is_clockwise, num_segments=None):
+    """Helper function to generate points along an arc for plotting.
+
+    num_segments defaults to enough chords to stay within ARC_TOLERANCE of the arc.
+    """
     center_x = current_x + i_offset
     center_y = current_y + j_offset
     radius = math.sqrt(i_offset**2 + j_offset**2)
@@ -266,86 +361,130 @@ def get_arc_points(current_x, current_y, target_x, target_y, i_offset, j_offset,
         else:
             end_angle = start_angle + 2 * math.pi
             
-    points = []
-    for k in range(num_segments + 1):
-        angle = start_angle + (end_angle - start_angle) * k / num_segments
-        x = center_x + radius * math.cos(angle)
-        y = center_y + radius * math.sin(angle)
-        points.append((x, y))
-    return points
-
-
-def simulate_gcode(gcode_filepath, offset_x=0.0, offset_y=0.0, start_x=0.0, start_y=0.0, end_x=0.0, end_y=0.0):
-    """Simulate G-code by plotting the toolpath using Plotly."""
-    print("[SIM] simulate_gcode started."); sys.stdout.flush()
+    if num_segments is None:
+        num_segments = _arc_segs(radius, end_angle - start_angle)
+    xs, ys = sample_arc(center_x, center_y, radius, start_angle, end_angle, num_segments + 1)
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+def _gcode_words(gcode_text):
+    """(commands, words) of the code lines in gcode_text; words is (N, 5) X, Y, Z, I, J, NaN where absent."""
+    commands = []
+    code_lines = []
+    for line in gcode_text.split('\n'):
+        head = line.split(None, 1)
+        if head and not head[0].startswith(';'):
+            commands.append(head[0])
+            code_lines.append(line)
+    # Tokenize every coordinate word in one regex scan, then decode them as arrays
+    tokens = np.array(GCODE_WORD_RE.findall('\n'.join(code_lines).encode()), dtype='S')
+    is_newline = tokens == b'\n'
+    rows = np.cumsum(is_newline)[~is_newline]  # line index of each word
+    words = tokens[~is_newline]
+    width = words.dtype.itemsize
+    chars = words.view(np.uint8).reshape(-1, width)
+    column = np.zeros(256, dtype=np.intp)
+    column[np.frombuffer(GCODE_AXES.encode('ascii'), dtype=np.uint8)] = np.arange(len(GCODE_AXES))
+    cols = column[chars[:, 0]]
+    # Drop the axis letter and parse the remaining bytes as floats
+    values = chars[:, 1:].copy().view('S%d' % max(width - 1, 1)).ravel().astype(np.float64)
+    table = np.full((len(commands), len(GCODE_AXES)), np.nan)
+    table[rows, cols] = values
+    return commands, table
+
+
+def _fill_moves(commands, words):
+    """parse_gcode_moves() output from per-line commands and their (N, 5) NaN-for-absent words."""
+    n = len(commands)
+    # Row 0 is the origin the tool starts from; missing words stay NaN until filled
+    coords = np.empty((n + 1, len(GCODE_AXES)))
+    coords[0] = 0.0
+    coords[1:] = words
+    # Forward-fill X/Y/Z: each row takes the last row (at or above it) where the word was present
+    xyz = coords[:, :3]
+    last_set = np.where(np.isnan(xyz), 0, np.arange(n + 1)[:, None])
+    np.maximum.accumulate(last_set, axis=0, out=last_set)
+    coords[:, :3] = np.take_along_axis(xyz, last_set, axis=0)
+    # I/J are per-line offsets, not modal
+    ij = coords[:, 3:]
+    ij[np.isnan(ij)] = 0.0
+    return commands, coords[1:]
+
+
+def parse_gcode_moves(gcode_text):
+    """Parse G-code text into moves: (commands, coords).
+
+    commands is a list of the command word of every line; coords is an (N, 5) float array of
+    X, Y, Z, I, J per line. X, Y, Z are the absolute position after the move (carried over
+    from the previous line when a word is omitted, starting from 0); I, J default to 0.
+    Blank lines and ';' comments are skipped.
+    """
+    return _fill_moves(*_gcode_words(gcode_text))
+
+
+def simulate_gcode(gcode_filepath, offset_x=0.0, offset_y=0.0, start_x=0.0, start_y=0.0, end_x=0.0, end_y=0.0, html_filepath='simulation_plot.html', name=None, moves=None):
+    """Simulate G-code by plotting the toolpath using Plotly, saving the page to html_filepath.
+
+    name is the job name used in the page's title and refresh/download links; it defaults to
+    the G-code file name without its extension.
+    moves, as returned by dxf_to_gcode(..., return_moves=True), skips re-parsing the file;
+    the file is then only read for the page's G-code editor.
+    """
+    log.debug("[SIM] simulate_gcode started.")
+    if name is None:
+        name = os.path.splitext(os.path.basename(gcode_filepath))[0]
     try:
-        print(f"[SIM] Attempting to open G-code file: {gcode_filepath}"); sys.stdout.flush()
+        log.debug("[SIM] Attempting to open G-code file: %s", gcode_filepath)
         
         # 打开G代码文件
         with open(gcode_filepath, 'r') as f:
-            gcode_lines = f.readlines()
-        print("[SIM] G-code file opened successfully."); sys.stdout.flush()
+            gcode_text = f.read()  # kept whole for the page's editor
+        log.debug("[SIM] G-code file opened successfully.")
+        if moves is None:
+            moves = parse_gcode_moves(gcode_text)
         
         # 初始化绘图数据
         fig = go.Figure()
         current_pos = {'x': 0, 'y': 0, 'z': 0}
         
         # 按Z高度分段收集轨迹
-        segments_by_z = {}  # z值 -> {'x':[], 'y':[]}
+        segments_by_z = collections.defaultdict(lambda: ([], []))  # z值 -> (xs, ys)
+        # 同时收集所有刀具运动点（动画用）
+        tool_path_points = []  # [[x, y], ...]
         
-        # 处理每行G代码
-        for i, line in enumerate(gcode_lines):
-            line = line.strip()
-            if not line or line.startswith(';'):
-                continue  # 跳过空行和注释
-                
-            print(f"[SIM] Processing line {i+1}: {line}"); sys.stdout.flush()
+        # 处理每个运动（已跳过空行和注释）
+        commands, coords_array = moves
+        for i, (command, (mx, my, mz, mi, mj)) in enumerate(zip(commands, coords_array.tolist())):
+            log.debug("[SIM] Processing move %d: %s", i + 1, command)
+            coords = {'x': mx, 'y': my, 'z': mz, 'i': mi, 'j': mj}
             
-            # 提取G代码命令和参数
-            # 示例行: G01 X10.0 Y20.0 Z-1.0 F100.0
-            line_parts = line.split()
-            if not line_parts:
-                continue
-                
-            command = line_parts[0]
-            print(f"[SIM] Command: {command}"); sys.stdout.flush()
-                
-            # 解析坐标和参数
-            coords = {'x': current_pos['x'], 'y': current_pos['y'], 'z': current_pos['z'], 'i': 0, 'j': 0}
-            for part in line_parts[1:]:
-                if part.startswith('X'):
-                    coords['x'] = float(part[1:])
-                elif part.startswith('Y'):
-                    coords['y'] = float(part[1:])
-                elif part.startswith('Z'):
-                    coords['z'] = float(part[1:])
-                elif part.startswith('I'):
-                    coords['i'] = float(part[1:])
-                elif part.startswith('J'):
-                    coords['j'] = float(part[1:])
+            log.debug("[SIM] Parsed Coords: X%s Y%s Z%s I%s J%s", mx, my, mz, mi, mj)
             
-            print(f"[SIM] Parsed Coords: X{coords['x']} Y{coords['y']} Z{coords['z']} I{coords['i']} J{coords['j']}"); sys.stdout.flush()
+            # 原地不动的直线移动不产生轨迹段和动画点
+            if (command in ['G0', 'G00', 'G1', 'G01']
+                    and mx == current_pos['x'] and my == current_pos['y'] and mz == current_pos['z']):
+                continue
             
             # 根据G代码命令绘制
             if command in ['G0', 'G00']:
-                print(f"[SIM] Plotting G00 from ({current_pos['x']:.2f},{current_pos['y']:.2f}) to ({coords['x']:.2f},{coords['y']:.2f})"); sys.stdout.flush()
+                log.debug("[SIM] Plotting G00 from (%.2f,%.2f) to (%.2f,%.2f)", current_pos['x'], current_pos['y'], mx, my)
                 # 按Z分段记录
                 z_level = current_pos['z']
-                seg = segments_by_z.setdefault(z_level, {'x':[], 'y':[]})
-                seg['x'].extend([current_pos['x'], coords['x'], None])
-                seg['y'].extend([current_pos['y'], coords['y'], None])
-                print("[SIM] G00 plotted."); sys.stdout.flush()
+                seg_x, seg_y = segments_by_z[z_level]
+                seg_x += (current_pos['x'], coords['x'], None)
+                seg_y += (current_pos['y'], coords['y'], None)
+                tool_path_points.append([coords['x'], coords['y']])
             
             elif command in ['G1', 'G01']:
-                print(f"[SIM] Plotting G01 from ({current_pos['x']:.2f},{current_pos['y']:.2f}) to ({coords['x']:.2f},{coords['y']:.2f})"); sys.stdout.flush()
+                log.debug("[SIM] Plotting G01 from (%.2f,%.2f) to (%.2f,%.2f)", current_pos['x'], current_pos['y'], mx, my)
                 # 按Z分段记录
                 z_level = current_pos['z']
-                seg = segments_by_z.setdefault(z_level, {'x':[], 'y':[]})
-                seg['x'].extend([current_pos['x'], coords['x'], None])
-                seg['y'].extend([current_pos['y'], coords['y'], None])
-                print("[SIM] G01 plotted."); sys.stdout.flush()
+                seg_x, seg_y = segments_by_z[z_level]
+                seg_x += (current_pos['x'], coords['x'], None)
+                seg_y += (current_pos['y'], coords['y'], None)
+                tool_path_points.append([coords['x'], coords['y']])
             
-            elif command in ['G2', 'G02', 'G3', 'G03']:
+            elif command in ['G2', 'G02', 'G3', 'G03'] and (mi or mj):  # I=J=0: 半径为零，不采样
                 center_x = current_pos['x'] + coords['i']
                 center_y = current_pos['y'] + coords['j']
                 
@@ -354,80 +493,65 @@ def simulate_gcode(gcode_filepath, offset_x=0.0, offset_y=0.0, start_x=0.0, star
                 start_angle = math.atan2(current_pos['y'] - center_y, current_pos['x'] - center_x)
                 end_angle = math.atan2(coords['y'] - center_y, coords['x'] - center_x)
                 
-                # 调整G3/G03（逆时针）的角度
-                if command in ['G3', 'G03']:
-                    if end_angle > start_angle:
-                        end_angle -= 2 * math.pi
-                else:  # G2/G02（顺时针）
-                    if end_angle < start_angle:
-                        end_angle += 2 * math.pi
+                log.debug("[SIM] Calculating arc points for %s from (%.2f,%.2f) to (%.2f,%.2f) with I%.2f J%.2f",
+                          command, current_pos['x'], current_pos['y'], mx, my, mi, mj)
                 
-                # 生成圆弧上的点用于绘图
-                num_points = 21  # 用于圆弧的点数
-                print(f"[SIM] Calculating arc points for {command} from ({current_pos['x']:.2f},{current_pos['y']:.2f}) to ({coords['x']:.2f},{coords['y']:.2f}) with I{coords['i']:.2f} J{coords['j']:.2f}"); sys.stdout.flush()
-                
-                arc_x = []
-                arc_y = []
-                
-                if command in ['G2', 'G02']:  # 顺时针
-                    if end_angle <= start_angle:
-                        end_angle += 2 * math.pi
-                    theta_values = [start_angle + (end_angle - start_angle) * i / (num_points - 1) for i in range(num_points)]
-                    for theta in theta_values:
-                        arc_x.append(center_x + radius * math.cos(theta))
-                        arc_y.append(center_y + radius * math.sin(theta))
-                    # 添加None以分隔多个圆弧段
-                    arc_x.append(None)
-                    arc_y.append(None)
-                    # 按Z分段记录圆弧
-                    z_level = current_pos['z']
-                    seg = segments_by_z.setdefault(z_level, {'x':[], 'y':[]})
-                    seg['x'].extend(arc_x)
-                    seg['y'].extend(arc_y)
-                else:  # G3/G03逆时针
-                    if end_angle >= start_angle:
-                        end_angle -= 2 * math.pi
-                    theta_values = [start_angle + (end_angle - start_angle) * i / (num_points - 1) for i in range(num_points)]
-                    for theta in theta_values:
-                        arc_x.append(center_x + radius * math.cos(theta))
-                        arc_y.append(center_y + radius * math.sin(theta))
-                    # 添加None以分隔多个圆弧段
-                    arc_x.append(None)
-                    arc_y.append(None)
-                    # 按Z分段记录圆弧
-                    z_level = current_pos['z']
-                    seg = segments_by_z.setdefault(z_level, {'x':[], 'y':[]})
-                    seg['x'].extend(arc_x)
-                    seg['y'].extend(arc_y)
+                # 调整终止角：G2/G02角度递增，终止角落在(start, start+2π]；G3/G03角度递减，落在[start-2π, start)
+                # （起止点重合即为整圆）
+                sign = 1 if command in ['G2', 'G02'] else -1
+                if sign * (end_angle - start_angle) <= 0:
+                    end_angle += sign * 2 * math.pi
+                # 生成圆弧上的点用于绘图，点数按弦高误差自适应
+                num_points = _arc_segs(radius, end_angle - start_angle) + 1
+                # 逐点旋转采样圆弧点（每段圆弧只计算一次sin/cos）
+                arc_x, arc_y = sample_arc(center_x, center_y, radius, start_angle, end_angle, num_points)
+                arc_x = arc_x.tolist()
+                arc_y = arc_y.tolist()
+                # 同一组圆弧点用于动画轨迹
+                tool_path_points.extend(zip(arc_x, arc_y))
+                # 按Z分段记录圆弧，添加None以分隔多个圆弧段
+                z_level = current_pos['z']
+                seg_x, seg_y = segments_by_z[z_level]
+                seg_x += arc_x
+                seg_x.append(None)
+                seg_y += arc_y
+                seg_y.append(None)
                 
-                print(f"[SIM] Arc points calculated: {len(arc_x)-1} points."); sys.stdout.flush()
-                print("[SIM] Arc plotted."); sys.stdout.flush()
+                log.debug("[SIM] Arc points calculated: %d points.", len(arc_x))
             
             # 更新当前位置
             current_pos['x'] = coords['x']
             current_pos['y'] = coords['y']
             current_pos['z'] = coords['z']
-            
-            print(f"[SIM] End of line {i+1} processing. New current_pos: X{current_pos['x']:.2f} Y{current_pos['y']:.2f} Z{current_pos['z']:.2f}"); sys.stdout.flush()
+
         
         # 根据Z高度使用Viridis连续色带显示所有轨迹（包括快速移动和切削移动）
         z_levels = sorted(segments_by_z.keys())
         colorscale = pcolors.sequential.Viridis
         n = len(z_levels)
+        # Z高度按色带颜色分组：同色的高度合并为一条轨迹（各段已以None分隔）
+        color_groups = {}  # 色带索引 -> [z值, ...]
         for idx_z, z_level in enumerate(z_levels):
-            seg = segments_by_z[z_level]
-            if not seg['x']:
+            if not segments_by_z[z_level][0]:
                 continue
             ratio = idx_z/(n-1) if n>1 else 0
             cs_idx = int(ratio*(len(colorscale)-1))
-            color = colorscale[cs_idx]
-            fig.add_trace(go.Scatter(x=seg['x'], y=seg['y'], mode='lines',
-                                    line=dict(color=color, width=2),
-                                    name=f'Z={z_level:.3f}', showlegend=True))
+            color_groups.setdefault(cs_idx, []).append(z_level)
+        for cs_idx, group in color_groups.items():
+            xs, ys = [], []
+            for z_level in group:
+                seg_x, seg_y = segments_by_z[z_level]
+                xs += seg_x
+                ys += seg_y
+            label = f'Z={group[0]:.3f}' if len(group) == 1 else f'Z={group[0]:.3f}~{group[-1]:.3f}'
+            # 路径轨迹用WebGL渲染；起点/终点标记仍用SVG的go.Scatter
+            fig.add_trace(go.Scattergl(x=xs, y=ys, mode='lines',
+                                      line=dict(color=colorscale[cs_idx], width=2),
+                                      name=label, showlegend=True))
         
         # 设置图表属性
         fig.update_layout(
-            title=f"G-code路径模拟 - {os.path.basename(gcode_filepath)}",
+            title=f"G-code路径模拟 - {name}.gcode",
             xaxis_title="X轴 (mm)",
             yaxis_title="Y轴 (mm)",
             legend_title="G代码指令",
@@ -448,79 +572,30 @@ def simulate_gcode(gcode_filepath, offset_x=0.0, offset_y=0.0, start_x=0.0, star
         fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='lightgrey')
         fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='lightgrey')
         
-        # === 1. 收集所有刀具运动点 ===
-        tool_path_points = []  # [[x, y], ...]
-        cur_x, cur_y, cur_z = 0, 0, 0
-        for i, line in enumerate(gcode_lines):
-            line = line.strip()
-            if not line or line.startswith(';'):
-                continue
-            line_parts = line.split()
-            if not line_parts:
-                continue
-            command = line_parts[0]
-            coords = {'x': cur_x, 'y': cur_y, 'z': cur_z, 'i': 0, 'j': 0}
-            for part in line_parts[1:]:
-                if part.startswith('X'):
-                    coords['x'] = float(part[1:])
-                elif part.startswith('Y'):
-                    coords['y'] = float(part[1:])
-                elif part.startswith('Z'):
-                    coords['z'] = float(part[1:])
-                elif part.startswith('I'):
-                    coords['i'] = float(part[1:])
-                elif part.startswith('J'):
-                    coords['j'] = float(part[1:])
-            # 只记录XY平面运动
-            if command in ['G0', 'G00', 'G1', 'G01']:
-                # 直线插补：直接起点到终点
-                tool_path_points.append([coords['x'], coords['y']])
-                cur_x, cur_y, cur_z = coords['x'], coords['y'], coords['z']
-            elif command in ['G2', 'G02', 'G3', 'G03']:
-                # 圆弧插补：插值为多个点
-                center_x = cur_x + coords['i']
-                center_y = cur_y + coords['j']
-                radius = math.sqrt(coords['i']**2 + coords['j']**2)
-                start_angle = math.atan2(cur_y - center_y, cur_x - center_x)
-                end_angle = math.atan2(coords['y'] - center_y, coords['x'] - center_x)
-                num_points = 21
-                if command in ['G3', 'G03']:
-                    if end_angle > start_angle:
-                        end_angle -= 2 * math.pi
-                else:
-                    if end_angle < start_angle:
-                        end_angle += 2 * math.pi
-                theta_values = [start_angle + (end_angle - start_angle) * i / (num_points - 1) for i in range(num_points)]
-                for theta in theta_values:
-                    px = center_x + radius * math.cos(theta)
-                    py = center_y + radius * math.sin(theta)
-                    tool_path_points.append([px, py])
-                cur_x, cur_y, cur_z = coords['x'], coords['y'], coords['z']
-            # 其他命令不计入动画轨迹
         # 防止轨迹为空
         if not tool_path_points:
             tool_path_points = [[0, 0]]
+        path = np.array(tool_path_points, dtype=np.float64)  # (N, 2)
         # Apply custom start point translation
         if start_x != 0.0 or start_y != 0.0:
-            dx = start_x - tool_path_points[0][0]
-            dy = start_y - tool_path_points[0][1]
-            tool_path_points = [[p[0] + dx, p[1] + dy] for p in tool_path_points]
+            path += (start_x - path[0, 0], start_y - path[0, 1])
         # Override end point to user-specified coordinates
-        tool_path_points[-1] = [end_x, end_y]
+        if end_x != 0.0 or end_y != 0.0:
+            path[-1] = (end_x, end_y)
         import json
-        tool_path_points_json = json.dumps(tool_path_points)
+        tool_path_points_json = json.dumps(path.tolist())
         # Add markers for tool start and end points
-        if tool_path_points:
-            sx, sy = tool_path_points[0]
-            ex, ey = tool_path_points[-1]
+        if len(path):
+            sx, sy = path[0].tolist()
+            ex, ey = path[-1].tolist()
             fig.add_trace(go.Scatter(x=[sx], y=[sy], mode='markers', marker=dict(color='green', size=12), name='Start Point'))
             fig.add_trace(go.Scatter(x=[ex], y=[ey], mode='markers', marker=dict(color='red', size=12), name='End Point'))
         # === 2. 美化前端并加入动画 ===
-        html_filename = 'simulation_plot.html'
+        html_filename = html_filepath
         try:
-            print(f"[SIM] Saving interactive plot to {html_filename}"); sys.stdout.flush()
+            log.debug("[SIM] Saving interactive plot to %s", html_filename)
             plot_html = fig.to_html(include_plotlyjs='cdn', full_html=False, default_height='700px', div_id='plot')
-            custom_html = '''<!DOCTYPE html>
+            html_parts = ['''<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
   <meta charset="UTF-8">
@@ -534,45 +609,45 @@ def simulate_gcode(gcode_filepath, offset_x=0.0, offset_y=0.0, start_x=0.0, star
 <div class="container py-4">
   <h1 class="mb-4">G-code 路径可视化与仿真</h1>
   <form action="/convert" method="post" class="row mb-3">
-    <input type="hidden" name="filename" value="''' + os.path.splitext(os.path.basename(gcode_filepath))[0] + '''">
+    <input type="hidden" name="filename" value="''', name, '''">
     <div class="col-6">
       <label>Start X (mm):</label>
-      <input name="start_x" type="number" class="form-control" step="0.01" value="''' + str(start_x) + '''">
+      <input name="start_x" type="number" class="form-control" step="0.01" value="''', str(start_x), '''">
     </div>
     <div class="col-6">
       <label>Start Y (mm):</label>
-      <input name="start_y" type="number" class="form-control" step="0.01" value="''' + str(start_y) + '''">
+      <input name="start_y" type="number" class="form-control" step="0.01" value="''', str(start_y), '''">
     </div>
     <div class="col-6">
       <label>End X (mm):</label>
-      <input name="end_x" type="number" class="form-control" step="0.01" value="''' + str(end_x) + '''">
+      <input name="end_x" type="number" class="form-control" step="0.01" value="''', str(end_x), '''">
     </div>
     <div class="col-6">
       <label>End Y (mm):</label>
-      <input name="end_y" type="number" class="form-control" step="0.01" value="''' + str(end_y) + '''">
+      <input name="end_y" type="number" class="form-control" step="0.01" value="''', str(end_y), '''">
     </div>
     <div class="col-6">
       <label>X 偏移 (mm):</label>
-      <input name="offset_x" type="number" class="form-control" step="0.01" value="''' + str(offset_x) + '''">
+      <input name="offset_x" type="number" class="form-control" step="0.01" value="''', str(offset_x), '''">
     </div>
     <div class="col-6">
       <label>Y 偏移 (mm):</label>
-      <input name="offset_y" type="number" class="form-control" step="0.01" value="''' + str(offset_y) + '''">
+      <input name="offset_y" type="number" class="form-control" step="0.01" value="''', str(offset_y), '''">
     </div>
     <div class="col-12 d-flex justify-content-between mt-2">
       <button type="submit" class="btn btn-primary">更新仿真</button>
-      <a href="/download?filename=''' + os.path.splitext(os.path.basename(gcode_filepath))[0] + '''" class="btn btn-success">下载 G-code</a>
+      <a href="/download?filename=''', name, '''" class="btn btn-success">下载 G-code</a>
     </div>
   </form>
   <div class="row mb-3">
     <div class="col-12">
-      ''' + plot_html + '''
+      ''', plot_html, '''
     </div>
   </div>
   <div class="row">
     <div class="col-12">
       <h5>G-code 编辑</h5>
-      <textarea id="gcode_editor" class="form-control mb-2" rows="20">''' + ''.join(gcode_lines) + '''</textarea>
+      <textarea id="gcode_editor" class="form-control mb-2" rows="20">''', html.escape(gcode_text, quote=False), '''</textarea>
     </div>
   </div>
 </div>
@@ -581,7 +656,7 @@ def simulate_gcode(gcode_filepath, offset_x=0.0, offset_y=0.0, start_x=0.0, star
 <script src="https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.65.5/codemirror.min.js"></script>
 <script src="https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.65.5/mode/gcode/gcode.min.js"></script>
 <script>
-  window.toolPathPoints = ''' + tool_path_points_json + ''';
+  window.toolPathPoints = ''', tool_path_points_json, ''';
   window.originalToolPathPoints = JSON.parse(JSON.stringify(window.toolPathPoints));
 </script>
 <div class="row mb-3">
@@ -610,97 +685,155 @@ document.addEventListener('DOMContentLoaded', function() {
   });
 });
 </script>
- '''
+ ''']
             # 写入自定义HTML
             with open(html_filename, 'w', encoding='utf-8') as f:
-                f.write(custom_html)
-            print(f"[SIM] Simulation plot saved to {html_filename}"); sys.stdout.flush()
-            print(f"[SIM] You can open this HTML file in any web browser to view and interact with the plot."); sys.stdout.flush()
+                f.writelines(html_parts)
+            log.info("[SIM] Simulation plot saved to %s", html_filename)
         except Exception as e:
-            print(f"[SIM] Error saving interactive plot: {e}"); sys.stdout.flush()
+            log.error("[SIM] Error saving interactive plot: %s", e)
             
-        print("[SIM] simulate_gcode finished successfully."); sys.stdout.flush()
+        log.debug("[SIM] simulate_gcode finished successfully.")
     except Exception as e:
-        print(f"[SIM] Error in simulate_gcode: {e}"); sys.stdout.flush()
-
-
-def dxf_to_gcode(dxf_filepath, gcode_filepath, feed_rate_xy, feed_rate_z, safe_z, cut_z, offset_x=0.0, offset_y=0.0, start_x=0.0, start_y=0.0, end_x=0.0, end_y=0.0):
+        log.error("[SIM] Error in simulate_gcode: %s", e)
+
+
+def _post_process(batches, offset_x, offset_y, start_x, start_y, end_x, end_y):
+    """Yield each entity's move records with the global offsets and custom start/end points applied.
+
+    Adds the global XY offsets, then puts the first and last moves that have both X and Y
+    at the custom start and end points. A start or end point of (0, 0) means none was given.
+    With an end point, the batch holding the latest XY move (and any after it) is held back
+    until the next XY move arrives, since only then is it known not to be the last.
+    """
+    set_start = bool(start_x or start_y)
+    set_end = bool(end_x or end_y)
+    held = []  # batches from the one holding last_xy onward
+    last_xy = None  # (batch, index) of the latest move with both X and Y
+    for moves in batches:
+        out = []
+        batch_xy = None
+        for code, x, y, z, i, j, f in moves:
+            x += offset_x  # NaN (no X word) stays NaN
+            y += offset_y
+            if x == x and y == y:
+                if set_start:
+                    x, y = start_x, start_y
+                    set_start = False
+                batch_xy = len(out)
+            out.append((code, x, y, z, i, j, f))
+        if not set_end:
+            yield out
+        elif batch_xy is not None:
+            yield from held
+            held = [out]
+            last_xy = (out, batch_xy)
+        elif held:
+            held.append(out)
+        else:
+            yield out
+    if last_xy is not None:
+        out, index = last_xy
+        code, x, y, z, i, j, f = out[index]
+        out[index] = (code, end_x, end_y, z, i, j, f)
+    yield from held
+
+
+def _round3(values):
+    """values rounded exactly as '%.3f' rounds them (np.round alone breaks near-ties wrongly)."""
+    scaled = values * 1000.0
+    rounded = np.round(scaled)
+    result = rounded / 1000.0
+    # Near a tie the product's own rounding may decide wrongly; defer to the formatter there
+    near_tie = np.abs(np.abs(scaled - rounded) - 0.5) < 1e-6
+    if near_tie.any():
+        result[near_tie] = [float('%.3f' % v) for v in values[near_tie].tolist()]
+    return result
+
+
+def _program_moves(header, batches, footer):
+    """parse_gcode_moves() output for the header lines, move-record batches and footer lines.
+
+    Only the few header and footer lines are parsed; the move records are used directly.
+    """
+    head_commands, head_words = _gcode_words('\n'.join(header))
+    foot_commands, foot_words = _gcode_words('\n'.join(footer))
+    # One flat object array of every record field (no per-record tuples), viewed as (N, 7)
+    fields = itertools.chain.from_iterable(itertools.chain.from_iterable(batches))
+    records = np.array(list(fields), dtype=object).reshape(-1, 7)
+    words = _round3(records[:, 1:6].astype(np.float64))  # X, Y, Z, I, J as written to the file
+    return _fill_moves(head_commands + records[:, 0].tolist() + foot_commands,
+                       np.concatenate((head_words, words, foot_words)))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_dxf(digest, path):
+    """ezdxf.readfile(path), reused for every conversion of the same content digest (documents are only read)."""
+    return ezdxf.readfile(path)
+
+
+def dxf_to_gcode(dxf_filepath, gcode_filepath, feed_rate_xy, feed_rate_z, safe_z, cut_z, offset_x=0.0, offset_y=0.0, start_x=0.0, start_y=0.0, end_x=0.0, end_y=0.0, return_moves=False, dxf_digest=None):
+    """Convert a DXF file to G-code at gcode_filepath.
+
+    dxf_digest, a digest of the file's contents, lets the parsed document be reused by later
+    conversions of the same content; without it the file is always read afresh.
+
+    With return_moves=True the program is also returned as parse_gcode_moves() output, built
+    from the move records rather than by parsing the G-code, ready to pass to
+    simulate_gcode(moves=...).
+    """
     try:
-        doc = ezdxf.readfile(dxf_filepath)
+        if dxf_digest is None:
+            doc = ezdxf.readfile(dxf_filepath)
+        else:
+            doc = _load_dxf(dxf_digest, dxf_filepath)
         msp = doc.modelspace()
     except IOError:
-        print(f"Error: Cannot open DXF file: {dxf_filepath}")
+        log.error("Error: Cannot open DXF file: %s", dxf_filepath)
         return
     except ezdxf.DXFStructureError:
-        print(f"Error: Invalid or corrupt DXF file: {dxf_filepath}")
+        log.error("Error: Invalid or corrupt DXF file: %s", dxf_filepath)
         return
 
-    gcode = generate_gcode_header(safe_z)
-    current_pos = None # (x,y,z) - tracks the current tool position
-
-    print(f"Processing DXF entities from {dxf_filepath}...")
+    written = []  # move-record batches as written, kept only for return_moves
     entities_processed = 0
-    for entity in msp:
-        entity_gcode = []
-        if entity.dxftype() == 'LINE':
-            print(f"  Found LINE from ({entity.dxf.start.x:.2f}, {entity.dxf.start.y:.2f}) to ({entity.dxf.end.x:.2f}, {entity.dxf.end.y:.2f})")
-            entity_gcode, current_pos = line_to_gcode(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z)
-            entities_processed += 1
-        elif entity.dxftype() == 'ARC':
-            print(f"  Found ARC center=({entity.dxf.center.x:.2f}, {entity.dxf.center.y:.2f}), R={entity.dxf.radius:.2f}, "
-                  f"StartAngle={entity.dxf.start_angle:.2f}, EndAngle={entity.dxf.end_angle:.2f}")
-            entity_gcode, current_pos = arc_to_gcode(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z)
+
+    def entity_moves():
+        """Move records of each supported entity, in modelspace (drawing) order."""
+        nonlocal entities_processed
+        current_pos = None # (x,y,z) - tracks the current tool position
+        for entity in msp.query(' '.join(ENTITY_HANDLERS)):
+            handler = ENTITY_HANDLERS[entity.dxftype()]
+            moves, current_pos = handler(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z)
             entities_processed += 1
-        elif entity.dxftype() == 'CIRCLE':
-            print(f"  Found CIRCLE center=({entity.dxf.center.x:.2f}, {entity.dxf.center.y:.2f}), R={entity.dxf.radius:.2f}")
-            entity_gcode, current_pos = circle_to_gcode(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z)
-            entities_processed +=1
-        elif entity.dxftype() == 'LWPOLYLINE':
-            print(f"  Found LWPOLYLINE with {len(list(entity.get_points(format='xyseb')))} points.")
-            entity_gcode, current_pos = lwpolyline_to_gcode(entity, current_pos, feed_rate_xy, feed_rate_z, safe_z, cut_z)
-            entities_processed +=1
-        
-        if entity_gcode:
-            gcode.extend(entity_gcode)
-
-    gcode.extend(generate_gcode_footer(safe_z))
-
-    # Apply global XY translation offsets
-    if offset_x or offset_y:
-        translated = []  # will hold offset-adjusted lines
-        for line in gcode:
-            new_line = line
-            if 'X' in new_line:
-                new_line = re.sub(r'X([-+]?\d*\.?\d+)', lambda m: f"X{float(m.group(1))+offset_x:.3f}", new_line)
-            if 'Y' in new_line:
-                new_line = re.sub(r'Y([-+]?\d*\.?\d+)', lambda m: f"Y{float(m.group(1))+offset_y:.3f}", new_line)
-            translated.append(new_line)
-        gcode = translated
-
-    # Custom start/end G-code adjustments (exclude footer)
-    footer = generate_gcode_footer(safe_z)
-    pre_gcode = gcode[:-len(footer)]
-    # update first XY move
-    for i, line in enumerate(pre_gcode):
-        if 'X' in line and 'Y' in line:
-            pre_gcode[i] = re.sub(r'X([-+]?\d*\.?\d+)', f"X{start_x:.3f}", pre_gcode[i])
-            pre_gcode[i] = re.sub(r'Y([-+]?\d*\.?\d+)', f"Y{start_y:.3f}", pre_gcode[i])
-            break
-    # update last XY move
-    for i in range(len(pre_gcode)-1, -1, -1):
-        if 'X' in pre_gcode[i] and 'Y' in pre_gcode[i]:
-            pre_gcode[i] = re.sub(r'X([-+]?\d*\.?\d+)', f"X{end_x:.3f}", pre_gcode[i])
-            pre_gcode[i] = re.sub(r'Y([-+]?\d*\.?\d+)', f"Y{end_y:.3f}", pre_gcode[i])
-            break
-    gcode = pre_gcode + footer
+            yield moves
 
+    log.info("Processing DXF entities from %s...", dxf_filepath)
     try:
         with open(gcode_filepath, 'w') as f:
-            for line in gcode:
-                f.write(line + '\n')
-        print(f"Successfully converted {entities_processed} entities and saved G-code to: {gcode_filepath}")
+            def emit(lines):
+                f.write('\n'.join(lines) + '\n')
+
+            header = generate_gcode_header(safe_z)
+            footer = generate_gcode_footer(safe_z)
+            emit(header)
+            batches = entity_moves()
+            # Without offsets or custom start/end points the records are written as emitted
+            if offset_x or offset_y or start_x or start_y or end_x or end_y:
+                batches = _post_process(batches, offset_x, offset_y, start_x, start_y, end_x, end_y)
+            for moves in batches:
+                if moves:
+                    emit(itertools.starmap(format_move, moves))
+                    if return_moves:
+                        written.append(moves)
+            emit(footer)
+        log.info("Successfully converted %d entities and saved G-code to: %s", entities_processed, gcode_filepath)
     except IOError:
-        print(f"Error: Cannot write G-code file: {gcode_filepath}")
+        log.error("Error: Cannot write G-code file: %s", gcode_filepath)
+        return
+
+    if return_moves:
+        return _program_moves(header, written, footer)
 
 
 def main():
@@ -719,34 +852,30 @@ def main():
     parser.add_argument('--start-y', type=float, default=0.0, help='Custom start Y coordinate')
     parser.add_argument('--end-x', type=float, default=0.0, help='Custom end X coordinate')
     parser.add_argument('--end-y', type=float, default=0.0, help='Custom end Y coordinate')
+    parser.add_argument('--verbose', action='store_true', help='Log every entity and simulated move')
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.verbose:
+        log.setLevel(logging.DEBUG)  # this module only, not ezdxf's own debug output
     
     try:
-        # Print parsed arguments
-        print(f"Input file: {args.input_file}")
-        print(f"Output file: {args.output_file}")
-        print(f"Feed rate XY: {args.feedrate_xy}")
-        print(f"Feed rate Z: {args.feedrate_z}")
-        print(f"Safe Z: {args.safe_z}")
-        print(f"Cut Z: {args.cut_z}")
-        print(f"Offset X: {args.offset_x}")
-        print(f"Offset Y: {args.offset_y}")
-        print(f"Simulation: {'Requested (but will be skipped)' if args.simulate else 'Disabled'}")
-        print(f"Start X: {args.start_x}")
-        print(f"Start Y: {args.start_y}")
-        print(f"End X: {args.end_x}")
-        print(f"End Y: {args.end_y}")
+        # Echo parsed arguments (--verbose only; batch runs stay quiet)
+        for name, value in vars(args).items():
+            log.debug("%s: %s", name, value)
         
         # Core functionality: Convert DXF to G-code and simulate if requested
-        print("[MAIN] Calling dxf_to_gcode..."); sys.stdout.flush()
-        dxf_to_gcode(args.input_file, args.output_file, 
-                     args.feedrate_xy, args.feedrate_z, 
-                     args.safe_z, args.cut_z, args.offset_x, args.offset_y, args.start_x, args.start_y, args.end_x, args.end_y)
-        print("[MAIN] dxf_to_gcode returned."); sys.stdout.flush()
+        log.debug("[MAIN] Calling dxf_to_gcode...")
+        moves = dxf_to_gcode(args.input_file, args.output_file,
+                             feed_rate_xy=args.feedrate_xy, feed_rate_z=args.feedrate_z,
+                             safe_z=args.safe_z, cut_z=args.cut_z,
+                             offset_x=args.offset_x, offset_y=args.offset_y,
+                             start_x=args.start_x, start_y=args.start_y, end_x=args.end_x, end_y=args.end_y,
+                             return_moves=args.simulate)
+        log.debug("[MAIN] dxf_to_gcode returned.")
         
         if args.simulate:
-            print("[MAIN] Calling simulate_gcode with Plotly..."); sys.stdout.flush()
-            simulate_gcode(args.output_file, offset_x=args.offset_x, offset_y=args.offset_y, start_x=args.start_x, start_y=args.start_y, end_x=args.end_x, end_y=args.end_y)
+            log.debug("[MAIN] Calling simulate_gcode with Plotly...")
+            simulate_gcode(args.output_file, offset_x=args.offset_x, offset_y=args.offset_y, start_x=args.start_x, start_y=args.start_y, end_x=args.end_x, end_y=args.end_y, moves=moves)
             print("[NOTE] G-code was generated successfully.")
             print("[NOTE] An interactive HTML visualization has been created. Open 'simulation_plot.html' in your browser.")
     
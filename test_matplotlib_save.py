@@ -1,44 +1,33 @@
+import io
 import matplotlib
-# 使用TkAgg作为交互式后端而不是Agg
-matplotlib.use('TkAgg') 
+# 使用非交互式的Agg后端：无需显示器，也不会阻塞在GUI事件循环上
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import sys
 
-print(f"Matplotlib version: {matplotlib.__version__}")
-print(f"Matplotlibrc file path: {matplotlib.matplotlib_fname()}")
-print(f"Default backend being used: {matplotlib.get_backend()}")
-sys.stdout.flush()
 
-print("Attempting to create a simple plot and save it...")
-sys.stdout.flush()
+def main():
+    print(f"Matplotlib version: {matplotlib.__version__}")
+    print(f"Matplotlibrc file path: {matplotlib.matplotlib_fname()}")
+    print(f"Default backend being used: {matplotlib.get_backend()}")
 
-try:
-    fig, ax = plt.subplots()
-    ax.plot([1, 2, 3], [1, 2, 3]) # A very simple line
-    
-    print("Attempting to display the plot instead of saving...")
+    print("Attempting to create a simple plot and save it...")
     sys.stdout.flush()
-    
-    # 显示图形而不是保存
-    print("Calling plt.show()...")
-    sys.stdout.flush()
-    plt.show()
-    
-    print("Plot displayed successfully")
-    sys.stdout.flush()
-    
-    # 关闭图形之前先检查是否还存在
-    if plt.fignum_exists(fig.number):
+
+    try:
+        fig, ax = plt.subplots()
+        ax.plot([1, 2, 3], [1, 2, 3]) # A very simple line
+
+        # 保存到内存缓冲区而不是显示图形
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png')
+        print(f"Plot saved successfully ({buf.tell()} bytes of PNG)")
         plt.close(fig) # Close the figure
-        print("Plot closed.")
-        sys.stdout.flush()
-    else:
-        print("Figure was already closed by plt.show()")
-        sys.stdout.flush()
-
-except Exception as e:
-    print(f"Python-level error during save: {e}")
-    sys.stdout.flush()
+    except Exception as e:
+        print(f"Python-level error during save: {e}")
+
+    print("Test script finished.")
+
 
-print("Test script finished.")
-sys.stdout.flush()
+if __name__ == '__main__':
+    main()